@@ -8,15 +8,27 @@ Now includes physical button support for hardware control
 import os
 import sys
 import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, jsonify, request
-import RPi.GPIO as GPIO
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
+from flask import Flask, Response, render_template, request
+from flask.logging import default_handler
 import time
 import threading
 import signal
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import copy
+import functools
+import hashlib
+import hmac
+import ipaddress
 import json
+import mmap
+import platform
+import queue
+import sched
+import struct
+import types
 from pathlib import Path
 
 # Configuration
@@ -39,7 +51,8 @@ class Config:
                 "1": 0.5, "2": 0.5, "3": 0.5, "4": 0.5,
                 "5": 0.5, "6": 0.5, "7": 0.5, "8": 0.5
             },
-            "max_concurrent_triggers": 3
+            "max_concurrent_triggers": 3,
+            "gpio_backend": "auto"
         },
         "button_settings": {
             "enabled": True,
@@ -51,7 +64,8 @@ class Config:
         "server": {
             "host": "0.0.0.0",
             "port": 5000,
-            "debug": False
+            "debug": False,
+            "cpu_affinity": []
         },
         "logging": {
             "log_dir": "/var/log/relay_control",
@@ -59,52 +73,130 @@ class Config:
             "max_size_mb": 10,
             "backup_count": 5,
             "log_level": "INFO"
+        },
+        "security": {
+            "enable_auth": False,
+            "api_key": "",
+            "allowed_ips": []
         }
     }
 
     def __init__(self, config_file="config.json"):
         """Load configuration from file or use defaults"""
         self.config_file = config_file
+        self._mtime = None
+        # Serializes writers so concurrent saves never share the temporary file
+        self._write_lock = threading.Lock()
         self.config = self._load_config()
+        # Bumped whenever the config changes so derived caches can notice
+        self.generation = 0
 
     def _load_config(self):
         """Load configuration from JSON file"""
         try:
-            config_path = Path(self.config_file)
-            if config_path.exists():
-                with open(self.config_file, 'r') as f:
-                    user_config = json.load(f)
-                config = self._defaults.copy()
-                self._deep_update(config, user_config)
-                print(f"Configuration loaded from {self.config_file}")
-                return config
-            else:
-                print(f"No config file found, using defaults")
-                with open(self.config_file, 'w') as f:
-                    json.dump(self._defaults, f, indent=4)
-                return self._defaults.copy()
+            config, self._mtime = self._read_config()
+            sys.stderr.write(f"Configuration loaded from {self.config_file}\n")
+            return config
+        except FileNotFoundError:
+            sys.stderr.write(f"No config file found, using defaults\n")
+            try:
+                self._write_config(self._defaults)
+            except Exception as e:
+                sys.stderr.write(f"Error saving config: {e}\n")
+            return copy.deepcopy(self._defaults)
         except Exception as e:
-            print(f"Error loading config: {e}, using defaults")
-            return self._defaults.copy()
+            sys.stderr.write(f"Error loading config: {e}, using defaults\n")
+            return copy.deepcopy(self._defaults)
+
+    def _read_config(self):
+        """Read the config file merged over the defaults; returns (config, mtime)"""
+        mtime = os.stat(self.config_file).st_mtime_ns
+        with open(self.config_file, 'r') as f:
+            user_config = json.load(f)
+        config = copy.deepcopy(self._defaults)
+        self._deep_update(config, user_config)
+        return config, mtime
 
     def _deep_update(self, base, update):
-        """Recursively update nested dictionaries"""
-        for key, value in update.items():
-            if key in base and isinstance(base[key], dict) and isinstance(value, dict):
-                self._deep_update(base[key], value)
-            else:
-                base[key] = value
+        """Update nested dictionaries, walking them with a worklist instead of recursion"""
+        pending = [(base, update)]
+        while pending:
+            base, update = pending.pop()
+            for key, value in update.items():
+                if key in base and isinstance(base[key], dict) and isinstance(value, dict):
+                    pending.append((base[key], value))
+                else:
+                    base[key] = value
+
+    def _write_config(self, data):
+        """Write data to the config file atomically and durably via a temporary file"""
+        text = json.dumps(data, indent=4)
+        tmp_file = f"{self.config_file}.tmp"
+        with self._write_lock:
+            # Leave the file (and the SD card) alone when nothing changed
+            try:
+                with open(self.config_file, 'r') as f:
+                    if f.read() == text:
+                        return
+            except FileNotFoundError:
+                pass
+            with open(tmp_file, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.config_file)
+            # Persist the rename itself so a power cut cannot lose it
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.config_file)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            self._mtime = os.stat(self.config_file).st_mtime_ns
 
     def save_config(self):
         """Save current configuration to file"""
+        self._clear_cached()
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=4)
+            self._write_config(self.config)
             return True
         except Exception as e:
-            print(f"Error saving config: {e}")
+            sys.stderr.write(f"Error saving config: {e}\n")
             return False
 
+    def restore(self, previous):
+        """Put back an earlier configuration, in memory and on disk"""
+        self.config = previous
+        return self.save_config()
+
+    def reload(self):
+        """Re-read the config file if it changed on disk; returns True if it did
+
+        A file that cannot be read or parsed leaves the current configuration
+        in place; only the first load falls back to the defaults.
+        """
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        # A broken file is not retried until it changes again
+        self._mtime = mtime
+        try:
+            self.config, self._mtime = self._read_config()
+        except Exception as e:
+            sys.stderr.write(f"Error reloading config: {e}, keeping current configuration\n")
+            return False
+        self._clear_cached()
+        return True
+
+    def _clear_cached(self):
+        """Drop memoized properties so they are rebuilt from self.config"""
+        for name, attr in type(self).__dict__.items():
+            if isinstance(attr, functools.cached_property):
+                self.__dict__.pop(name, None)
+        self.generation += 1
+
     def update_config(self, section, updates):
         """Update a configuration section"""
         if section in self.config:
@@ -115,83 +207,394 @@ class Config:
             return self.save_config()
         return False
 
-    @property
+    @functools.cached_property
     def RELAY_PINS(self):
-        return {int(k): v for k, v in self.config["relay_pins"].items()}
+        return types.MappingProxyType({int(k): v for k, v in self.config["relay_pins"].items()})
 
-    @property
+    @functools.cached_property
+    def RELAY_COUNT(self):
+        return len(self.RELAY_PINS)
+
+    @functools.cached_property
     def RELAY_NAMES(self):
-        return {int(k): v for k, v in self.config.get("relay_names", {}).items()}
+        return types.MappingProxyType({int(k): v for k, v in self.config.get("relay_names", {}).items()})
 
-    @property
+    @functools.cached_property
     def RELAY_ACTIVE_LOW(self):
         return self.config["relay_settings"]["active_low"]
 
-    @property
+    @functools.cached_property
     def RELAY_TRIGGER_DURATIONS(self):
-        return {int(k): float(v) for k, v in self.config["relay_settings"]["trigger_durations"].items()}
+        return types.MappingProxyType(
+            {int(k): float(v) for k, v in self.config["relay_settings"]["trigger_durations"].items()})
 
-    @property
+    @functools.cached_property
     def MAX_CONCURRENT_TRIGGERS(self):
         return self.config["relay_settings"]["max_concurrent_triggers"]
 
-    @property
+    @functools.cached_property
+    def GPIO_BACKEND(self):
+        return self.config["relay_settings"].get("gpio_backend", "auto")
+
+    @functools.cached_property
     def BUTTON_ENABLED(self):
         return self.config.get("button_settings", {}).get("enabled", False)
 
-    @property
+    @functools.cached_property
     def BUTTON_PIN(self):
         return self.config.get("button_settings", {}).get("button_pin", 26)
 
-    @property
+    @functools.cached_property
     def BUTTON_RELAY(self):
         return self.config.get("button_settings", {}).get("relay_number", 1)
 
-    @property
+    @functools.cached_property
     def BUTTON_PULL_UP(self):
         return self.config.get("button_settings", {}).get("pull_up", True)
 
-    @property
+    @functools.cached_property
     def BUTTON_DEBOUNCE(self):
         # Always cast to float
         return float(self.config.get("button_settings", {}).get("debounce_time", 0.3))
 
-    @property
+    @functools.cached_property
     def HOST(self):
         return self.config["server"]["host"]
 
-    @property
+    @functools.cached_property
     def PORT(self):
         return self.config["server"]["port"]
 
-    @property
+    @functools.cached_property
     def DEBUG(self):
         return self.config["server"]["debug"]
 
-    @property
+    @functools.cached_property
+    def CPU_AFFINITY(self):
+        return frozenset(int(cpu) for cpu in self.config["server"].get("cpu_affinity", []))
+
+    @functools.cached_property
     def LOG_DIR(self):
         return self.config["logging"]["log_dir"]
 
-    @property
+    @functools.cached_property
     def LOG_FILE(self):
         return self.config["logging"]["log_file"]
 
-    @property
+    @functools.cached_property
     def LOG_MAX_SIZE(self):
         return self.config["logging"]["max_size_mb"] * 1024 * 1024
 
-    @property
+    @functools.cached_property
     def LOG_BACKUP_COUNT(self):
         return self.config["logging"]["backup_count"]
 
-    @property
+    @functools.cached_property
     def LOG_LEVEL(self):
         return self.config["logging"]["log_level"]
 
+    @functools.cached_property
+    def ENABLE_AUTH(self):
+        return self.config.get("security", {}).get("enable_auth", False)
+
+    @functools.cached_property
+    def API_KEY(self):
+        return self.config.get("security", {}).get("api_key", "")
+
+    @functools.cached_property
+    def API_KEY_BYTES(self):
+        return self.API_KEY.encode()
+
+    @functools.cached_property
+    def ALLOWED_IPS(self):
+        return self.config.get("security", {}).get("allowed_ips", [])
+
+    @functools.cached_property
+    def _allowed_ip_set(self):
+        return frozenset(ip for ip in self.ALLOWED_IPS if '/' not in ip)
+
+    @functools.cached_property
+    def _allowed_cidrs(self):
+        networks = []
+        for entry in self.ALLOWED_IPS:
+            if '/' in entry:
+                try:
+                    networks.append(ipaddress.ip_network(entry, strict=False))
+                except ValueError:
+                    sys.stderr.write(f"Ignoring invalid allowed_ips entry: {entry}\n")
+        return networks
+
+    def is_allowed(self, ip):
+        """Check a client address against allowed_ips (an empty list allows all)"""
+        if not self.ALLOWED_IPS or ip in self._allowed_ip_set:
+            return True
+        if self._allowed_cidrs:
+            try:
+                addr = ipaddress.ip_address(ip)
+            except ValueError:
+                return False
+            return any(addr in net for net in self._allowed_cidrs)
+        return False
+
+
+# Stand-in for RPi.GPIO on development machines without GPIO hardware
+class _StubGPIO:
+    """No-op replacement for RPi.GPIO that remembers output levels"""
+
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+
+    _levels = {}
+
+    @staticmethod
+    def setmode(mode):
+        pass
+
+    @staticmethod
+    def setwarnings(flag):
+        pass
+
+    @staticmethod
+    def setup(pin, mode, pull_up_down=None):
+        pass
+
+    @classmethod
+    def output(cls, pin, value):
+        for p in (pin if isinstance(pin, (list, tuple)) else [pin]):
+            cls._levels[p] = value
+
+    @classmethod
+    def input(cls, pin):
+        return cls._levels.get(pin, cls.HIGH)
+
+    @staticmethod
+    def add_event_detect(pin, edge, callback=None, bouncetime=None):
+        pass
+
+    @staticmethod
+    def remove_event_detect(pin):
+        pass
+
+    @staticmethod
+    def wait_for_edge(pin, edge, timeout=None, bouncetime=None):
+        time.sleep((timeout or 0) / 1000)
+        return None
+
+    @staticmethod
+    def cleanup():
+        pass
+
+
+GPIO = None
+
+
+def load_gpio():
+    """Import RPi.GPIO on Raspberry Pi hardware, or fall back to a no-op stub"""
+    global GPIO
+    if GPIO is None:
+        GPIO = _StubGPIO
+        if platform.machine().startswith(('arm', 'aarch64')):
+            # ARM dev machines and CI runners have no RPi.GPIO (or no Pi under it)
+            try:
+                import RPi.GPIO
+                GPIO = RPi.GPIO
+            except (ImportError, RuntimeError):
+                pass
+    return GPIO
+
+
+# GPIO backends for relay outputs
+class GpioBackend:
+    """Drive relay output pins through RPi.GPIO"""
+
+    name = "rpi_gpio"
+
+    def setup_output(self, pin, value):
+        GPIO.setup(pin, GPIO.OUT)
+        self.set(pin, value)
+
+    def set(self, pin, value):
+        GPIO.output(pin, value)
+
+    def get(self, pin):
+        return GPIO.input(pin)
+
+    def set_many(self, pins, value):
+        GPIO.output(list(pins), value)
+
+    def close(self):
+        pass
+
+
+class PigpioBackend(GpioBackend):
+    """Drive relay output pins over one persistent pigpiod connection"""
+
+    name = "pigpio"
+
+    def __init__(self):
+        import pigpio
+        self.pigpio = pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("pigpio daemon is not running")
+
+    def setup_output(self, pin, value):
+        self.pi.set_mode(pin, self.pigpio.OUTPUT)
+        self.set(pin, value)
+
+    def set(self, pin, value):
+        self.pi.write(pin, value)
+
+    def get(self, pin):
+        return self.pi.read(pin)
+
+    def set_many(self, pins, value):
+        mask = 0
+        for pin in pins:
+            mask |= 1 << pin
+        if value:
+            self.pi.set_bank_1(mask)
+        else:
+            self.pi.clear_bank_1(mask)
+
+    def close(self):
+        self.pi.stop()
+
+
+class MmapBackend(GpioBackend):
+    """Drive relay output pins by writing BCM2835-BCM2711 GPIO registers directly
+
+    Pin function select is still done through RPi.GPIO; only the set/clear/level
+    registers are touched here, so every write is a single 32-bit store.
+    """
+
+    name = "mmap"
+
+    GPIOMEM = "/dev/gpiomem"
+    GPSET0 = 0x1C
+    GPCLR0 = 0x28
+    GPLEV0 = 0x34
+
+    def __init__(self):
+        fd = os.open(self.GPIOMEM, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+    def setup_output(self, pin, value):
+        if not 0 <= pin < 32:
+            raise ValueError(f"GPIO {pin} is outside register bank 0")
+        super().setup_output(pin, value)
 
-# Button Handler Class using polling instead of interrupts
+    def set(self, pin, value):
+        struct.pack_into('<I', self.mem, self.GPSET0 if value else self.GPCLR0, 1 << pin)
+
+    def get(self, pin):
+        return (struct.unpack_from('<I', self.mem, self.GPLEV0)[0] >> pin) & 1
+
+    def set_many(self, pins, value):
+        mask = 0
+        for pin in pins:
+            mask |= 1 << pin
+        struct.pack_into('<I', self.mem, self.GPSET0 if value else self.GPCLR0, mask)
+
+    def close(self):
+        self.mem.close()
+
+
+class SysfsBackend(GpioBackend):
+    """Drive relay output pins through /sys/class/gpio with one open fd per pin"""
+
+    name = "sysfs"
+
+    SYSFS_GPIO = "/sys/class/gpio"
+
+    def __init__(self):
+        self.base = self._chip_base()
+        self.pin_fds = {}
+
+    def _chip_base(self):
+        """Find the sysfs number of BCM GPIO 0 (non-zero on newer kernels)"""
+        for chip in sorted(Path(self.SYSFS_GPIO).glob("gpiochip*")):
+            try:
+                label = (chip / "label").read_text().strip()
+                if label.startswith(("pinctrl-bcm", "pinctrl-rp1")):
+                    return int((chip / "base").read_text())
+            except (OSError, ValueError):
+                continue
+        return 0
+
+    def setup_output(self, pin, value):
+        gpio_dir = Path(self.SYSFS_GPIO) / f"gpio{self.base + pin}"
+        if not gpio_dir.exists():
+            Path(self.SYSFS_GPIO, "export").write_text(str(self.base + pin))
+        # "high"/"low" switches to output and sets the level in one write
+        (gpio_dir / "direction").write_text("high" if value else "low")
+        self.pin_fds[pin] = os.open(gpio_dir / "value", os.O_RDWR)
+
+    def set(self, pin, value):
+        os.pwrite(self.pin_fds[pin], b"1" if value else b"0", 0)
+
+    def get(self, pin):
+        return os.pread(self.pin_fds[pin], 1, 0)[0] - 48
+
+    def set_many(self, pins, value):
+        for pin in pins:
+            self.set(pin, value)
+
+    def close(self):
+        for pin, fd in self.pin_fds.items():
+            os.close(fd)
+            try:
+                Path(self.SYSFS_GPIO, "unexport").write_text(str(self.base + pin))
+            except OSError:
+                pass
+        self.pin_fds.clear()
+
+
+GPIO_BACKENDS = {
+    GpioBackend.name: GpioBackend,
+    PigpioBackend.name: PigpioBackend,
+    MmapBackend.name: MmapBackend,
+    SysfsBackend.name: SysfsBackend,
+}
+
+
+def _has_bcm_gpiomem():
+    """Check for a Pi whose /dev/gpiomem exposes the BCM283x register layout"""
+    if not platform.machine().startswith(('arm', 'aarch64')):
+        return False
+    if not os.path.exists(MmapBackend.GPIOMEM):
+        return False
+    try:
+        # The Pi 5 (BCM2712) routes GPIO through the RP1 with a different layout
+        return b"bcm2712" not in Path("/proc/device-tree/compatible").read_bytes()
+    except OSError:
+        return False
+
+
+def create_gpio_backend(name):
+    """Create the configured GPIO backend, falling back to RPi.GPIO"""
+    if name == "auto":
+        name = MmapBackend.name if _has_bcm_gpiomem() else GpioBackend.name
+    try:
+        return GPIO_BACKENDS[name]()
+    except Exception as e:
+        app.logger.warning(f"GPIO backend '{name}' unavailable ({e}), using RPi.GPIO")
+        return GpioBackend()
+
+
+# Button Handler Class using GPIO edge-detect callbacks
 class ButtonHandler:
-    """Handle physical button input for relay control using polling"""
+    """Handle physical button input for relay control using edge-detect callbacks"""
 
     def __init__(self, button_pin, relay_trigger_function, relay_number=1,
                  debounce_time=0.3, pull_up=True):
@@ -200,85 +603,174 @@ class ButtonHandler:
         self.relay_number = relay_number
         self.debounce_time = float(debounce_time)
         self.pull_up = pull_up
-        self.last_press_time = 0
-        self.last_state = None
-        self.polling_thread = None
-        self.stop_polling = threading.Event()
 
     def setup(self):
-        """Setup GPIO for button input using polling method"""
+        """Setup GPIO for button input and register the edge callback"""
         try:
             # Setup the pin
             if self.pull_up:
                 GPIO.setup(self.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
             else:
                 GPIO.setup(self.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            
-            # Get initial state
-            self.last_state = GPIO.input(self.button_pin)
-            
-            # Start polling thread
-            self.stop_polling.clear()
-            self.polling_thread = threading.Thread(target=self._poll_button, daemon=True)
-            self.polling_thread.start()
-            
-            app.logger.info(f"Button polling started on GPIO {self.button_pin} (polling mode)")
-            
+
+            # Press is HIGH to LOW with a pull-up, LOW to HIGH with a pull-down;
+            # the GPIO driver debounces and calls back on its own thread
+            GPIO.add_event_detect(
+                self.button_pin,
+                GPIO.FALLING if self.pull_up else GPIO.RISING,
+                callback=self._on_edge,
+                bouncetime=max(1, int(self.debounce_time * 1000))
+            )
+
+            app.logger.info(f"Button edge detection started on GPIO {self.button_pin}")
+
         except Exception as e:
             app.logger.error(f"Button setup failed: {e}")
             raise
 
-    def _poll_button(self):
-        """Poll the button state continuously"""
-        while not self.stop_polling.is_set():
-            try:
-                current_state = GPIO.input(self.button_pin)
-                
-                # Detect button press (transition from HIGH to LOW for pull-up)
-                if self.pull_up:
-                    button_pressed = (self.last_state == 1 and current_state == 0)
-                else:
-                    button_pressed = (self.last_state == 0 and current_state == 1)
-                
-                if button_pressed:
-                    current_time = time.time()
-                    if current_time - self.last_press_time >= self.debounce_time:
-                        self.last_press_time = current_time
-                        app.logger.info(f"Physical button pressed for Relay {self.relay_number}")
-                        
-                        # Trigger relay in a separate thread
-                        t = threading.Thread(
-                            target=self.trigger_relay,
-                            args=(self.relay_number,),
-                            name=f"button-relay-{self.relay_number}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        )
-                        t.daemon = True
-                        t.start()
-                
-                self.last_state = current_state
-                
-            except Exception as e:
-                app.logger.error(f"Error in button polling: {e}")
-            
-            # Small delay to prevent excessive CPU usage
-            time.sleep(0.01)  # 10ms polling rate
+    def _on_edge(self, channel):
+        """Edge callback; claims and switches the relay directly from the GPIO callback thread"""
+        try:
+            app.logger.info("Physical button pressed for Relay %d", self.relay_number)
+            # Claiming, the ON write and queueing the OFF take microseconds,
+            # and a busy relay is rejected here instead of queued in the pool
+            self.trigger_relay(self.relay_number)
+        except Exception as e:
+            app.logger.error("Error handling button press: %s", e)
 
     def cleanup(self):
-        """Stop polling thread"""
-        self.stop_polling.set()
-        if self.polling_thread and self.polling_thread.is_alive():
-            self.polling_thread.join(timeout=1)
-        app.logger.info("Button polling stopped")
+        """Remove the edge callback"""
+        try:
+            GPIO.remove_event_detect(self.button_pin)
+        except Exception as e:
+            app.logger.error(f"Error removing button edge detection: {e}")
+        app.logger.info("Button edge detection stopped")
+
+
+# Log file handler that rolls over without re-checking the file per record
+class FastRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that tracks the file size in memory
+
+    The stock handler formats every record twice and seeks (newer Pythons also
+    stat) the file before each write to decide on rollover. This process is
+    the only writer of its log, so the size is read once on open and then
+    counted as records are written.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._size = None
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self._size is None:
+                self._size = self.stream.seek(0, os.SEEK_END)
+            if self.maxBytes > 0 and self._size and self._size + len(msg) >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                self._size = self.stream.seek(0, os.SEEK_END)
+            self.stream.write(msg)
+            self.flush()
+            self._size += len(msg)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
 
 
 # Global variables
 app = Flask(__name__)
 config = Config()
-relay_locks = {}
-active_triggers = 0
-active_triggers_lock = threading.Lock()
-cleanup_done = False
+# Relay admission state: bit n of _busy_mask is set while relay n is being
+# pulsed, _active counts running triggers; both are guarded by _state_lock
+_busy_mask = 0
+_active = 0
+# Bit n is set while relay n's output is driven ON; this process is the only
+# writer of the relay pins, so /status reads this instead of the GPIO levels
+_relay_on_bits = 0
+# Bumped under _state_lock on every change to the three fields above
+_state_gen = 0
+_state_lock = threading.Lock()
+# Notified (with _state_lock held) whenever _state_gen changes
+_state_changed = threading.Condition(_state_lock)
+
+# Admission results of claim_relays()
+ADMITTED, RELAY_BUSY, TOO_MANY_TRIGGERS = range(3)
+REJECT_MESSAGES = {
+    RELAY_BUSY: 'Relay is already active',
+    TOO_MANY_TRIGGERS: 'Too many relays active, try again shortly',
+}
+# Taken once by the first cleanup_gpio() call and never released
+_cleanup_lock = threading.Lock()
+# Serializes admin config saves with applying them to the hardware
+_reconfig_lock = threading.Lock()
 button_handler = None
+gpio_backend = None
+# Buffers file log records; flushed when full, on WARNING+ and at exit
+log_buffer = None
+# Background thread that formats and writes queued log records
+log_listener = None
+
+# GPIO constants resolved in setup_relays(); _PIN_OF maps relay number to pin
+_ON = _OFF = None
+_PINS = ()
+_PIN_OF = ()
+executor = ThreadPoolExecutor(max_workers=config.MAX_CONCURRENT_TRIGGERS, thread_name_prefix="relay")
+
+# Pending relay OFF actions, all run by one background thread
+_off_wakeup = threading.Event()
+
+
+def _wait_for_off(timeout):
+    """Delay function for the OFF scheduler; returns early when a new OFF is queued"""
+    _off_wakeup.wait(timeout)
+    _off_wakeup.clear()
+
+
+_off_scheduler = sched.scheduler(time.monotonic, _wait_for_off)
+
+
+def schedule_off(delay, action, *args):
+    """Run action(*args) on the OFF scheduler thread after delay seconds"""
+    _off_scheduler.enter(delay, 0, action, args)
+    _off_wakeup.set()
+
+
+def run_pending_offs():
+    """Run every queued OFF action now instead of at its deadline"""
+    for event in _off_scheduler.queue:
+        try:
+            _off_scheduler.cancel(event)
+        except ValueError:
+            # The scheduler thread got to it first
+            continue
+        event.action(*event.argument)
+
+
+def _run_off_scheduler():
+    while True:
+        _off_wakeup.wait()
+        _off_wakeup.clear()
+        _off_scheduler.run()
+
+
+threading.Thread(target=_run_off_scheduler, name="relay-off", daemon=True).start()
+
+# Pre-serialized /status body, reused while the relay state and config are
+# unchanged; the TTL only bounds how stale the embedded timestamp gets
+STATUS_CACHE_TTL = 0.1
+_status_cache = {'ts': 0.0, 'key': None, 'body': None}
+_status_lock = threading.Lock()
+
+# /events: idle streams get a comment this often so proxies keep them open,
+# and each stream holds a server thread, so only a few may be open at once
+EVENT_KEEPALIVE = 15
+MAX_EVENT_STREAMS = 4
+_event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
 
 # Statistics tracking
 stats = {
@@ -288,71 +780,166 @@ stats = {
     'last_trigger_time': None,
     'errors': 0
 }
+# Guards every read-modify-write of stats; readers copy under it via stats_snapshot()
+stats_lock = threading.Lock()
+
+
+def stats_snapshot():
+    """Consistent copy of stats taken under stats_lock"""
+    with stats_lock:
+        snapshot = dict(stats)
+        snapshot['relay_triggers'] = dict(stats['relay_triggers'])
+    return snapshot
+
+
+def json_bytes(obj):
+    """Serialize obj to compact JSON bytes"""
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def json_response(obj, status=200):
+    """Build a JSON response without going through Flask's JSON provider"""
+    return Response(json_bytes(obj), status=status, mimetype='application/json')
+
+
+# Error bodies for the fixed error messages, encoded once at import
+_ERROR_BODIES = {
+    message: json_bytes({'status': 'error', 'message': message})
+    for message in (
+        'Access denied', 'Invalid or missing API key', 'Invalid relay number',
+        'Invalid relay list', 'Invalid duration', 'Invalid request',
+        'Endpoint not found', 'Internal server error', 'Too many event streams',
+        *REJECT_MESSAGES.values()
+    )
+}
+
+
+def error_response(message, status):
+    """JSON error response, reusing the pre-encoded body for fixed messages"""
+    body = _ERROR_BODIES.get(message)
+    if body is None:
+        body = json_bytes({'status': 'error', 'message': message})
+    return Response(body, status=status, mimetype='application/json')
+
+
+_iso_cache = (-1, '')
+
+
+def now_iso():
+    """Local time as an ISO 8601 string, reformatted at most every 250 ms"""
+    global _iso_cache
+    t = time.time()
+    bucket = int(t * 4)
+    if bucket != _iso_cache[0]:
+        lt = time.localtime(t)
+        _iso_cache = (bucket, '%04d-%02d-%02dT%02d:%02d:%02d.%03d' % (lt[:6] + (int(t * 1000) % 1000,)))
+    return _iso_cache[1]
+
+
+# Bytes read from the end of the log file; comfortably more than 100 lines
+LOG_TAIL_BYTES = 16384
+# Records held in memory before they are written to the log file together
+LOG_BUFFER_RECORDS = 32
+
+
+# Last tail read as (path, inode, mtime, size, lines)
+_log_tail_cache = (None, None, None, None, [])
+
+
+def tail_log(log_file, lines):
+    """Return the last lines of log_file, reading only its final LOG_TAIL_BYTES"""
+    global _log_tail_cache
+    try:
+        st = os.stat(log_file)
+    except FileNotFoundError:
+        return []
+    key = (log_file, st.st_ino, st.st_mtime_ns, st.st_size)
+    if _log_tail_cache[:4] == key:
+        return _log_tail_cache[4][-lines:]
+    with open(log_file, 'rb') as f:
+        start = max(0, st.st_size - LOG_TAIL_BYTES)
+        f.seek(start)
+        tail = f.read(st.st_size - start).decode('utf-8', 'replace').splitlines()
+    # Drop the partial first line when the read started mid-file
+    if start and tail:
+        tail = tail[1:]
+    _log_tail_cache = key + (tail,)
+    return tail[-lines:]
 
 
 def setup_logging():
-    """Configure logging with rotation"""
+    """Configure logging with rotation; records are written by a background listener"""
+    global log_buffer, log_listener
     try:
         Path(config.LOG_DIR).mkdir(parents=True, exist_ok=True)
         level = getattr(logging, config.LOG_LEVEL.upper(), logging.INFO)
+        # No format used here shows thread or process fields; skip collecting them
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
         fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh = RotatingFileHandler(
+        fh = FastRotatingFileHandler(
             os.path.join(config.LOG_DIR, config.LOG_FILE),
             maxBytes=config.LOG_MAX_SIZE,
             backupCount=config.LOG_BACKUP_COUNT
         )
         fh.setFormatter(fmt)
         fh.setLevel(level)
+        # Batch file writes; anything at WARNING or above is written out at once
+        log_buffer = MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=logging.WARNING, target=fh)
+        log_buffer.setLevel(level)
 
         ch = logging.StreamHandler(sys.stdout)
         ch.setFormatter(fmt)
         ch.setLevel(level)
 
+        # Request and relay threads only enqueue; the listener does the I/O
+        log_queue = queue.SimpleQueue()
+        qh = QueueHandler(log_queue)
+        log_listener = QueueListener(log_queue, log_buffer, ch, respect_handler_level=True)
+        log_listener.start()
+
         app.logger.setLevel(level)
-        app.logger.addHandler(fh)
-        app.logger.addHandler(ch)
+        app.logger.addHandler(qh)
+        # Flask's own stderr handler would still write on the calling thread
+        # and duplicate every console line; ch above covers the console
+        app.logger.removeHandler(default_handler)
 
         werk = logging.getLogger('werkzeug')
         werk.setLevel(logging.WARNING)
-        werk.addHandler(fh)
-        werk.addHandler(ch)
+        werk.addHandler(qh)
 
     except Exception as e:
         print(f"Failed to setup logging: {e}")
         logging.basicConfig(level=logging.INFO)
 
 
+def apply_cpu_affinity():
+    """Pin the serving thread, and every thread it starts afterwards, to the configured cores"""
+    cpus = config.CPU_AFFINITY
+    if not cpus:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        app.logger.warning("CPU affinity is not supported on this platform, ignoring cpu_affinity")
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+        app.logger.info(f"Pinned to CPU cores {sorted(cpus)}")
+    except (OSError, ValueError) as e:
+        app.logger.warning(f"Could not set CPU affinity {sorted(cpus)}: {e}")
+
+
 def setup_gpio():
     """Initialize GPIO pins for relay control"""
-    global button_handler
     try:
+        load_gpio()
+        if GPIO is _StubGPIO:
+            app.logger.warning("No GPIO hardware detected, relays are simulated")
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
 
-        # Setup relays
-        for relay_num, pin in config.RELAY_PINS.items():
-            GPIO.setup(pin, GPIO.OUT)
-            # OFF state
-            off_state = GPIO.HIGH if config.RELAY_ACTIVE_LOW else GPIO.LOW
-            GPIO.output(pin, off_state)
-            relay_locks[relay_num] = threading.Lock()
-
-        # Setup physical button
-        if config.BUTTON_ENABLED:
-            try:
-                button_handler = ButtonHandler(
-                    button_pin=config.BUTTON_PIN,
-                    relay_trigger_function=trigger_relay,
-                    relay_number=config.BUTTON_RELAY,
-                    debounce_time=config.BUTTON_DEBOUNCE,
-                    pull_up=config.BUTTON_PULL_UP
-                )
-                button_handler.setup()
-                app.logger.info(
-                    f"Physical button initialized on GPIO {config.BUTTON_PIN} for Relay {config.BUTTON_RELAY}"
-                )
-            except Exception:
-                app.logger.error("Failed to setup physical button", exc_info=True)
+        setup_relays()
+        setup_button()
 
         app.logger.info("GPIO initialization successful")
         return True
@@ -362,160 +949,605 @@ def setup_gpio():
         return False
 
 
+def check_relay_pins():
+    """Reject a relay pin map that cannot be set up, before any output is touched"""
+    pins = config.RELAY_PINS
+    if not pins or min(pins) < 1:
+        raise ValueError("Relay numbers must start at 1")
+    for pin in pins.values():
+        if type(pin) is not int or not 0 <= pin <= 27:
+            raise ValueError(f"Invalid relay GPIO pin: {pin!r}")
+    if len(set(pins.values())) != len(pins):
+        raise ValueError("Relay GPIO pins must be unique")
+    if config.BUTTON_ENABLED and config.BUTTON_PIN in pins.values():
+        raise ValueError(f"GPIO {config.BUTTON_PIN} is used by both a relay and the button")
+
+
+def setup_relays(backend=None):
+    """Set up the relay outputs from config, all relays OFF
+
+    The backend and pin table globals are only replaced once every output
+    is set up, so a failure leaves the previous ones in place.
+    """
+    global gpio_backend, _ON, _OFF, _PINS, _PIN_OF
+    check_relay_pins()
+    on = GPIO.LOW if config.RELAY_ACTIVE_LOW else GPIO.HIGH
+    off = GPIO.HIGH if config.RELAY_ACTIVE_LOW else GPIO.LOW
+    pins = tuple(sorted(config.RELAY_PINS.items()))
+    pin_of = [None] * (max(config.RELAY_PINS) + 1)
+    for relay_num, pin in pins:
+        pin_of[relay_num] = pin
+
+    if backend is None:
+        backend = create_gpio_backend(config.GPIO_BACKEND)
+
+    # Setup relays in the OFF state
+    try:
+        for relay_num, pin in pins:
+            backend.setup_output(pin, off)
+    except Exception as e:
+        if type(backend) is GpioBackend:
+            raise
+        app.logger.warning(f"GPIO backend '{backend.name}' failed to set up relay outputs ({e}), using RPi.GPIO")
+        try:
+            backend.close()
+        except Exception:
+            pass
+        backend = GpioBackend()
+        for relay_num, pin in pins:
+            backend.setup_output(pin, off)
+
+    gpio_backend, _ON, _OFF, _PINS, _PIN_OF = backend, on, off, pins, tuple(pin_of)
+    app.logger.info(f"Using GPIO backend: {gpio_backend.name}")
+
+    with stats_lock:
+        for relay_num, _ in _PINS:
+            stats['relay_triggers'].setdefault(relay_num, 0)
+
+
+def setup_button():
+    """(Re)create the physical button handler from config"""
+    global button_handler
+    if button_handler:
+        button_handler.cleanup()
+        button_handler = None
+    if not config.BUTTON_ENABLED:
+        return
+    # Checked once here so a press never has to reject the relay number
+    if config.BUTTON_RELAY not in config.RELAY_PINS:
+        app.logger.error(f"Button relay {config.BUTTON_RELAY} is not a configured relay, button disabled")
+        return
+    if config.BUTTON_PIN in config.RELAY_PINS.values():
+        app.logger.error(f"Button GPIO {config.BUTTON_PIN} is also a relay pin, button disabled")
+        return
+    try:
+        handler = ButtonHandler(
+            button_pin=config.BUTTON_PIN,
+            relay_trigger_function=trigger_relay,
+            relay_number=config.BUTTON_RELAY,
+            debounce_time=config.BUTTON_DEBOUNCE,
+            pull_up=config.BUTTON_PULL_UP
+        )
+        handler.setup()
+        button_handler = handler
+        app.logger.info(
+            f"Physical button initialized on GPIO {config.BUTTON_PIN} for Relay {config.BUTTON_RELAY}"
+        )
+    except Exception:
+        app.logger.error("Failed to setup physical button", exc_info=True)
+
+
+def reinit_relays():
+    """Move the relay outputs to the current config's pins without a restart
+
+    Raises if the new outputs cannot be set up; the previous outputs are
+    then set up again before the error propagates.
+    """
+    check_relay_pins()
+    backend = create_gpio_backend(config.GPIO_BACKEND)
+    while True:
+        # Running pulses end on the pins they started on
+        run_pending_offs()
+        with _state_lock:
+            # Claims wait on the lock, so no trigger starts mid-swap
+            if _active == 0:
+                _swap_relays(backend)
+                return
+        # A pulse is between its claim and queueing its OFF
+        time.sleep(0.01)
+
+
+def _swap_relays(backend):
+    """Replace the relay outputs with ones set up on backend; call with _state_lock held"""
+    global gpio_backend, _relay_on_bits, _state_gen
+    old_backend = gpio_backend
+    old_backend.set_many([pin for _, pin in _PINS], _OFF)
+    old_backend.close()
+    try:
+        setup_relays(backend)
+    except Exception:
+        try:
+            backend.close()
+        except Exception:
+            pass
+        # _PINS and _OFF still describe the previous outputs
+        restored = create_gpio_backend(old_backend.name)
+        for relay_num, pin in _PINS:
+            restored.setup_output(pin, _OFF)
+        gpio_backend = restored
+        raise
+    finally:
+        _relay_on_bits = 0
+        _state_gen += 1
+        _state_changed.notify_all()
+
+
+def apply_config_changes(old):
+    """Apply a saved config change in-process; returns True if a restart is still needed"""
+    new = config.config
+    if gpio_backend and (
+            old['relay_pins'] != new['relay_pins']
+            or any(old['relay_settings'].get(key) != new['relay_settings'].get(key)
+                   for key in ('active_low', 'gpio_backend'))):
+        try:
+            reinit_relays()
+        except Exception:
+            # Keep the file in step with the outputs that are actually live
+            config.restore(old)
+            raise
+        app.logger.info("Relay outputs re-initialized from new configuration")
+    if GPIO is not None and old['button_settings'] != new['button_settings']:
+        setup_button()
+    # Server and logging settings are only read at startup
+    return old['server'] != new['server'] or old['logging'] != new['logging']
+
+
+def reload_config():
+    """Pick up hand edits to config.json and apply them like an admin save"""
+    with _reconfig_lock:
+        # reload() swaps in a new dict, so the current one is the old config
+        old = config.config
+        if not config.reload():
+            return
+        app.logger.info(f"Configuration reloaded from {config.config_file}")
+        try:
+            if apply_config_changes(old):
+                app.logger.warning("Server and logging changes need a service restart")
+        except Exception as e:
+            app.logger.error(f"Reloaded configuration not applied, previous settings restored: {e}")
+
+
+def claim_relays(mask):
+    """Admit one trigger for the relays in mask, marking them busy"""
+    global _busy_mask, _active, _state_gen
+    with _state_lock:
+        if _busy_mask & mask:
+            return RELAY_BUSY
+        if _active >= config.MAX_CONCURRENT_TRIGGERS:
+            return TOO_MANY_TRIGGERS
+        _busy_mask |= mask
+        _active += 1
+        _state_gen += 1
+        _state_changed.notify_all()
+    return ADMITTED
+
+
+def release_relays(mask):
+    """Clear the busy bits in mask and free the trigger slot"""
+    global _busy_mask, _active, _state_gen
+    with _state_lock:
+        _busy_mask &= ~mask
+        _active -= 1
+        _state_gen += 1
+        _state_changed.notify_all()
+
+
+def relay_pin(relay_num):
+    """GPIO pin of a relay in the table the outputs were set up from, or None"""
+    # A just-saved config may name relays reinit_relays() has not set up yet
+    if 0 < relay_num < len(_PIN_OF):
+        return _PIN_OF[relay_num]
+    return None
+
+
+def relay_busy(relay_num):
+    """Whether a relay is currently being pulsed"""
+    return bool((_busy_mask >> relay_num) & 1)
+
+
+def mark_relays(mask, on):
+    """Record the relays in mask as switched ON or OFF"""
+    global _relay_on_bits, _state_gen
+    with _state_lock:
+        if on:
+            _relay_on_bits |= mask
+        else:
+            _relay_on_bits &= ~mask
+        _state_gen += 1
+        _state_changed.notify_all()
+
+
+def relay_on(relay_num):
+    """Whether a relay's output is currently driven ON"""
+    return bool((_relay_on_bits >> relay_num) & 1)
+
+
+def active_trigger_count():
+    """Number of triggers currently running"""
+    return _active
+
+
 def trigger_relay(relay_num):
     """Trigger a relay for its configured duration"""
-    global active_triggers, stats
+    global stats
 
-    if relay_num not in config.RELAY_PINS:
-        app.logger.error(f"Invalid relay number: {relay_num}")
-        stats['errors'] += 1
+    if relay_pin(relay_num) is None:
+        app.logger.error("Invalid relay number: %s", relay_num)
+        with stats_lock:
+            stats['errors'] += 1
         return False
 
-    with active_triggers_lock:
-        if active_triggers >= config.MAX_CONCURRENT_TRIGGERS:
-            app.logger.warning(f"Max concurrent triggers reached, rejecting relay {relay_num}")
-            return False
-        active_triggers += 1
+    result = claim_relays(1 << relay_num)
+    if result != ADMITTED:
+        app.logger.warning("Rejecting relay %d: %s", relay_num, REJECT_MESSAGES[result])
+        return False
+    return pulse_relay(relay_num)
 
-    try:
-        if not relay_locks[relay_num].acquire(blocking=False):
-            app.logger.warning(f"Relay {relay_num} is already active")
-            with active_triggers_lock:
-                active_triggers -= 1
-            return False
 
-        pin = config.RELAY_PINS[relay_num]
+def pulse_relay(relay_num):
+    """Switch a relay admitted by claim_relays() ON and schedule it OFF"""
+    global stats
+
+    try:
+        pin = relay_pin(relay_num)
+        if pin is None:
+            raise ValueError("no GPIO pin set up")
         duration = config.RELAY_TRIGGER_DURATIONS.get(relay_num, 0.5)
 
         # Turn ON
-        on_state = GPIO.LOW if config.RELAY_ACTIVE_LOW else GPIO.HIGH
-        GPIO.output(pin, on_state)
-        app.logger.info(f"Relay {relay_num} (GPIO {pin}) turned ON for {duration}s")
+        gpio_backend.set(pin, _ON)
+        mark_relays(1 << relay_num, True)
+        app.logger.info("Relay %d (GPIO %d) turned ON for %ss", relay_num, pin, duration)
 
-        stats['total_triggers'] += 1
-        stats['relay_triggers'][relay_num] += 1
-        stats['last_trigger_time'] = datetime.now()
+        with stats_lock:
+            stats['total_triggers'] += 1
+            stats['relay_triggers'][relay_num] += 1
+            stats['last_trigger_time'] = datetime.now()
 
-        time.sleep(duration)
+    except Exception as e:
+        app.logger.error("Error triggering relay %d: %s", relay_num, e)
+        with stats_lock:
+            stats['errors'] += 1
+        release_relays(1 << relay_num)
+        return False
 
-        # Turn OFF
-        off_state = GPIO.HIGH if config.RELAY_ACTIVE_LOW else GPIO.LOW
-        GPIO.output(pin, off_state)
-        app.logger.info(f"Relay {relay_num} (GPIO {pin}) turned OFF")
+    # Turn OFF later from the scheduler thread; this worker is free now
+    schedule_off(duration, end_pulse, relay_num)
+    return True
 
-        return True
+
+def end_pulse(relay_num):
+    """Switch a pulsed relay OFF and release it"""
+    global stats
+
+    pin = _PIN_OF[relay_num]
+    try:
+        gpio_backend.set(pin, _OFF)
+        mark_relays(1 << relay_num, False)
+        app.logger.info("Relay %d (GPIO %d) turned OFF", relay_num, pin)
 
     except Exception as e:
-        app.logger.error(f"Error triggering relay {relay_num}: {e}")
-        stats['errors'] += 1
+        app.logger.error("Error turning off relay %d: %s", relay_num, e)
+        with stats_lock:
+            stats['errors'] += 1
+
+    finally:
+        release_relays(1 << relay_num)
+
+
+def pulse_relays(relay_nums, mask, duration):
+    """Switch relays admitted together ON with one batched write and schedule them OFF"""
+    global stats
+
+    try:
+        pins = [relay_pin(relay_num) for relay_num in relay_nums]
+        if None in pins:
+            raise ValueError("no GPIO pin set up")
+        gpio_backend.set_many(pins, _ON)
+        mark_relays(mask, True)
+        app.logger.info("Relays %s (GPIO %s) turned ON for %ss", relay_nums, pins, duration)
+
+        with stats_lock:
+            stats['total_triggers'] += len(relay_nums)
+            for relay_num in relay_nums:
+                stats['relay_triggers'][relay_num] += 1
+            stats['last_trigger_time'] = datetime.now()
+
+    except Exception as e:
+        app.logger.error("Error triggering relays %s: %s", relay_nums, e)
+        with stats_lock:
+            stats['errors'] += 1
+        release_relays(mask)
         return False
 
+    schedule_off(duration, end_pulses, relay_nums, pins, mask)
+    return True
+
+
+def end_pulses(relay_nums, pins, mask):
+    """Switch relays pulsed together OFF with one batched write and release them"""
+    global stats
+
+    try:
+        gpio_backend.set_many(pins, _OFF)
+        mark_relays(mask, False)
+        app.logger.info("Relays %s (GPIO %s) turned OFF", relay_nums, pins)
+
+    except Exception as e:
+        app.logger.error("Error turning off relays %s: %s", relay_nums, e)
+        with stats_lock:
+            stats['errors'] += 1
+
     finally:
-        relay_locks[relay_num].release()
-        with active_triggers_lock:
-            active_triggers -= 1
+        release_relays(mask)
 
 
-@app.route('/')
-def index():
-    """Serve the main control panel"""
+# Endpoints reachable without authentication
+_PUBLIC_ENDPOINTS = frozenset({'health_check', 'static'})
+
+
+def check_auth():
+    """Apply IP whitelisting and API key authentication"""
+    # Read per request so turning auth on from the admin panel applies at once
+    if not config.ENABLE_AUTH or request.endpoint in _PUBLIC_ENDPOINTS:
+        return None
+
+    client_ip = request.remote_addr
+    if not config.is_allowed(client_ip):
+        app.logger.warning("Rejected request from non-whitelisted IP %s", client_ip)
+        return error_response('Access denied', 403)
+
+    if config.API_KEY:
+        provided_key = request.headers.get('X-API-Key') or request.args.get('api_key') or ''
+        if not hmac.compare_digest(provided_key.encode(), config.API_KEY_BYTES):
+            app.logger.warning("Rejected request from %s: invalid API key", client_ip)
+            return error_response('Invalid or missing API key', 401)
+
+    return None
+
+
+app.before_request(check_auth)
+
+
+# Rendered pages as template name -> (config generation, body, etag)
+_page_cache = {}
+
+
+def cached_page(template, build_context):
+    """Render a page that only depends on the config once per config generation"""
+    cached = _page_cache.get(template)
+    if cached is None or cached[0] != config.generation:
+        generation = config.generation
+        body = render_template(template, **build_context()).encode()
+        cached = (generation, body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        _page_cache[template] = cached
+    _, body, etag = cached
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def _index_context():
     relay_info = {}
     for relay_num in config.RELAY_PINS.keys():
         relay_info[relay_num] = {
             'name': config.RELAY_NAMES.get(relay_num, f'Relay {relay_num}'),
             'pin': config.RELAY_PINS[relay_num]
         }
-    return render_template('index.html', relay_info=relay_info, relay_count=len(config.RELAY_PINS))
+    return {'relay_info': relay_info, 'relay_count': config.RELAY_COUNT}
+
+
+@app.route('/')
+def index():
+    """Serve the main control panel"""
+    return cached_page('index.html', _index_context)
 
 
 @app.route('/relay/<int:relay_num>', methods=['POST'])
 def control_relay(relay_num):
     """Handle relay control requests"""
-    if relay_num < 1 or relay_num > len(config.RELAY_PINS):
-        app.logger.warning(f"Invalid relay number requested: {relay_num}")
-        return jsonify({'status': 'error', 'message': 'Invalid relay number'}), 400
+    if relay_pin(relay_num) is None:
+        app.logger.warning("Invalid relay number requested: %d", relay_num)
+        return error_response('Invalid relay number', 400)
 
     client_ip = request.remote_addr
-    app.logger.info(f"Relay {relay_num} trigger requested from {client_ip}")
+    app.logger.info("Relay %d trigger requested from %s", relay_num, client_ip)
 
-    if relay_locks[relay_num].locked():
-        return jsonify({'status': 'error', 'message': 'Relay is already active'}), 429
+    result = claim_relays(1 << relay_num)
+    if result != ADMITTED:
+        return error_response(REJECT_MESSAGES[result], 429)
 
-    t = threading.Thread(
-        target=trigger_relay,
-        args=(relay_num,),
-        name=f"relay-{relay_num}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    )
-    t.daemon = True
-    t.start()
+    executor.submit(pulse_relay, relay_num)
 
     duration = config.RELAY_TRIGGER_DURATIONS.get(relay_num, 0.5)
-    return jsonify({'status': 'success', 'relay': relay_num, 'duration': duration})
+    return json_response({'status': 'success', 'relay': relay_num, 'duration': duration})
+
+
+@app.route('/relay/batch', methods=['POST'])
+def control_relays():
+    """Trigger several relays at once for a shared duration"""
+    data = request.get_json(silent=True) or {}
+    relay_nums = data.get('relays')
+    if (not isinstance(relay_nums, list) or not relay_nums
+            or not all(isinstance(n, int) and not isinstance(n, bool) and relay_pin(n) is not None
+                       for n in relay_nums)):
+        return error_response('Invalid relay list', 400)
+    relay_nums = sorted(set(relay_nums))
+
+    durations = config.RELAY_TRIGGER_DURATIONS
+    duration = data.get('duration', max(durations.get(n, 0.5) for n in relay_nums))
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not 0 < duration <= 60:
+        return error_response('Invalid duration', 400)
+
+    client_ip = request.remote_addr
+    app.logger.info("Relays %s trigger requested from %s", relay_nums, client_ip)
+
+    # All relays of the batch are claimed in one step, so batches cannot deadlock
+    mask = 0
+    for relay_num in relay_nums:
+        mask |= 1 << relay_num
+    result = claim_relays(mask)
+    if result != ADMITTED:
+        return error_response(REJECT_MESSAGES[result], 429)
+
+    executor.submit(pulse_relays, relay_nums, mask, duration)
+
+    return json_response({'status': 'success', 'relays': relay_nums, 'duration': duration})
 
 
 @app.route('/status')
 def get_status():
     """Get current status of all relays"""
     try:
-        status = {
-            'relays': {},
-            'system': {
-                'active_triggers': active_triggers,
-                'max_concurrent': config.MAX_CONCURRENT_TRIGGERS,
-                'timestamp': datetime.now().isoformat(),
-                'button_enabled': config.BUTTON_ENABLED,
-                'button_pin': config.BUTTON_PIN if config.BUTTON_ENABLED else None,
-                'button_relay': config.BUTTON_RELAY if config.BUTTON_ENABLED else None
-            }
-        }
-        for relay_num, pin in config.RELAY_PINS.items():
-            curr = GPIO.input(pin)
-            is_on = (curr == GPIO.LOW) if config.RELAY_ACTIVE_LOW else (curr == GPIO.HIGH)
-            status['relays'][relay_num] = {
-                'name': config.RELAY_NAMES.get(relay_num, f'Relay {relay_num}'),
-                'state': 'ON' if is_on else 'OFF',
-                'locked': relay_locks[relay_num].locked(),
-                'gpio_pin': pin
+        with _status_lock:
+            now = time.monotonic()
+            key = (_state_gen, config.generation)
+            if key == _status_cache['key'] and now - _status_cache['ts'] < STATUS_CACHE_TTL:
+                return Response(_status_cache['body'], mimetype='application/json')
+            body = _build_status()
+            _status_cache.update(ts=now, key=key, body=body)
+        return Response(body, mimetype='application/json')
+    except Exception as e:
+        app.logger.error("Error getting status: %s", e)
+        return error_response(str(e), 500)
+
+
+@app.route('/events')
+def status_events():
+    """Stream the /status payload as server-sent events whenever relay state changes"""
+    if not _event_streams.acquire(blocking=False):
+        return error_response('Too many event streams', 503)
+
+    def stream():
+        try:
+            last = None
+            while True:
+                with _state_changed:
+                    _state_changed.wait_for(lambda: _state_gen != last, timeout=EVENT_KEEPALIVE)
+                    gen = _state_gen
+                if gen == last:
+                    yield b': keepalive\n\n'
+                    continue
+                last = gen
+                yield b'data: ' + _build_status() + b'\n\n'
+        finally:
+            _event_streams.release()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/status/hardware')
+def get_hardware_status():
+    """Read the relay outputs back from the GPIO pins, for diagnostics"""
+    try:
+        relays = {}
+        for relay_num, pin in _PINS:
+            state = 'ON' if gpio_backend.get(pin) == _ON else 'OFF'
+            expected = 'ON' if relay_on(relay_num) else 'OFF'
+            relays[relay_num] = {
+                'gpio_pin': pin,
+                'state': state,
+                'expected': expected,
+                'mismatch': state != expected
             }
-        return jsonify(status)
+        return json_response({'backend': gpio_backend.name, 'relays': relays, 'timestamp': now_iso()})
     except Exception as e:
-        app.logger.error(f"Error getting status: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        app.logger.error("Error reading hardware status: %s", e)
+        return error_response(str(e), 500)
+
+
+# Fixed parts of the /status payload as (config generation, relays, system)
+_status_template = (None, None, None)
+
+
+def _get_status_template():
+    """Per-relay and system fields that only change when the config does"""
+    global _status_template
+    generation, relays, system = _status_template
+    if generation != config.generation:
+        generation = config.generation
+        relays = [
+            (relay_num, {'name': config.RELAY_NAMES.get(relay_num, f'Relay {relay_num}'), 'gpio_pin': pin})
+            for relay_num, pin in _PINS
+        ]
+        system = {
+            'max_concurrent': config.MAX_CONCURRENT_TRIGGERS,
+            'button_enabled': config.BUTTON_ENABLED,
+            'button_pin': config.BUTTON_PIN if config.BUTTON_ENABLED else None,
+            'button_relay': config.BUTTON_RELAY if config.BUTTON_ENABLED else None
+        }
+        _status_template = (generation, relays, system)
+    return relays, system
+
+
+def _build_status():
+    """Read all relays and serialize the /status payload"""
+    relays, system = _get_status_template()
+    status = {
+        'relays': {
+            relay_num: dict(fixed, state='ON' if relay_on(relay_num) else 'OFF',
+                            locked=relay_busy(relay_num))
+            for relay_num, fixed in relays
+        },
+        'system': dict(system, active_triggers=active_trigger_count(), timestamp=now_iso())
+    }
+    return json_bytes(status)
+
+
+_HEALTH_BODY = json_bytes({'status': 'healthy'})
+_HEALTH_HEADERS = [('Content-Type', 'application/json'), ('Content-Length', str(len(_HEALTH_BODY)))]
 
 
 @app.route('/health')
 def health_check():
     """Health check endpoint for monitoring"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat(), 'uptime': time.process_time()})
+    return Response(_HEALTH_BODY, mimetype='application/json')
+
+
+def fast_health(wsgi_app):
+    """Answer GET /health probes before Flask routing and request hooks"""
+    def middleware(environ, start_response):
+        if environ.get('PATH_INFO') == '/health' and environ.get('REQUEST_METHOD') == 'GET':
+            start_response('200 OK', list(_HEALTH_HEADERS))
+            return [_HEALTH_BODY]
+        return wsgi_app(environ, start_response)
+    return middleware
+
+
+app.wsgi_app = fast_health(app.wsgi_app)
 
 
 @app.route('/admin')
 def admin_dashboard():
-    """Admin dashboard"""
-    uptime = datetime.now() - stats['start_time']
-    uptime_str = str(uptime).split('.')[0]
-    log_file = os.path.join(config.LOG_DIR, config.LOG_FILE)
-    recent_logs = []
-    try:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                recent_logs = f.readlines()[-50:]
-    except Exception as e:
-        app.logger.error(f"Error reading logs: {e}")
-    return render_template('admin.html', config=config.config, stats=stats, uptime=uptime_str, recent_logs=recent_logs)
+    """Admin dashboard; stats and logs are filled in by the page from /admin/stats and /admin/logs"""
+    reload_config()
+    return cached_page('admin.html', lambda: {'config': config.config})
 
 
 @app.route('/admin/stats')
 def admin_stats():
     """Get system statistics"""
-    uptime = datetime.now() - stats['start_time']
-    return jsonify({
+    snapshot = stats_snapshot()
+    uptime = datetime.now() - snapshot['start_time']
+    last_trigger = snapshot['last_trigger_time']
+    return json_response({
         'uptime': str(uptime).split('.')[0],
-        'total_triggers': stats['total_triggers'],
-        'relay_triggers': stats['relay_triggers'],
-        'last_trigger': stats['last_trigger_time'].isoformat() if stats['last_trigger_time'] else None,
-        'errors': stats['errors'],
-        'active_triggers': active_triggers
+        'total_triggers': snapshot['total_triggers'],
+        'relay_triggers': snapshot['relay_triggers'],
+        'last_trigger': last_trigger.isoformat() if last_trigger else None,
+        'errors': snapshot['errors'],
+        'active_triggers': active_trigger_count()
     })
 
 
@@ -525,32 +1557,45 @@ def admin_logs():
     log_file = os.path.join(config.LOG_DIR, config.LOG_FILE)
     logs = []
     try:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                for line in f.readlines()[-100:]:
-                    logs.append(line.strip())
+        # Write out buffered records so the view is current
+        if log_buffer:
+            log_buffer.flush()
+        logs = [line.strip() for line in tail_log(log_file, 100)]
     except Exception as e:
         app.logger.error(f"Error reading logs: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    return jsonify({'logs': logs})
+        return error_response(str(e), 500)
+    return json_response({'logs': logs})
 
 
 @app.route('/admin/config', methods=['GET', 'POST'])
 def admin_config():
     """Update configuration"""
+    # Hand edits to config.json are picked up here rather than lost on save
+    reload_config()
     if request.method == 'POST':
         try:
             data = request.json or {}
             section = data.get('section')
             settings = data.get('settings')
-            if section and settings and config.update_config(section, settings):
+            if not (section and settings):
+                return error_response('Invalid request', 400)
+            with _reconfig_lock:
+                old = copy.deepcopy(config.config)
+                if not config.update_config(section, settings):
+                    return error_response('Invalid request', 400)
                 app.logger.info(f"Configuration updated: {section}")
-                return jsonify({'status': 'success', 'message': 'Configuration updated. Restart service to apply changes.'})
-            return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
+                try:
+                    restart = apply_config_changes(old)
+                except Exception as e:
+                    app.logger.error(f"Configuration not applied, previous settings restored: {e}")
+                    return error_response(f'Configuration not applied: {e}', 400)
+            message = ('Configuration updated. Restart service to apply server and logging changes.'
+                       if restart else 'Configuration updated and applied.')
+            return json_response({'status': 'success', 'message': message})
         except Exception as e:
             app.logger.error(f"Error updating config: {e}")
-            return jsonify({'status': 'error', 'message': str(e)}), 500
-    return jsonify(config.config)
+            return error_response(str(e), 500)
+    return json_response(config.config)
 
 
 @app.route('/admin/test/<int:relay_num>', methods=['POST'])
@@ -562,50 +1607,61 @@ def admin_test_relay(relay_num):
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({'status': 'error', 'message': 'Endpoint not found'}), 404
+    return error_response('Endpoint not found', 404)
 
 
 @app.errorhandler(500)
 def internal_error(error):
     app.logger.error(f"Internal error: {error}")
-    return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
+    return error_response('Internal server error', 500)
 
 
 def cleanup_gpio():
-    """Clean up GPIO resources"""
-    global cleanup_done, button_handler
-    if not cleanup_done:
-        cleanup_done = True
-        try:
-            if button_handler:
-                button_handler.cleanup()
-                app.logger.info("Button handler cleanup completed")
-            off_state = GPIO.HIGH if config.RELAY_ACTIVE_LOW else GPIO.LOW
-            for pin in config.RELAY_PINS.values():
-                GPIO.output(pin, off_state)
+    """Clean up GPIO resources; only the first call does any work"""
+    # Non-blocking so a signal arriving mid-cleanup cannot deadlock on itself
+    if not _cleanup_lock.acquire(blocking=False):
+        return
+    try:
+        if button_handler:
+            button_handler.cleanup()
+            app.logger.info("Button handler cleanup completed")
+        executor.shutdown(wait=False)
+        # Switch relays that are mid-pulse OFF through their normal path
+        run_pending_offs()
+        if gpio_backend:
+            # Force every relay OFF in one batched write
+            gpio_backend.set_many([pin for _, pin in _PINS], _OFF)
+            mark_relays(~0, False)
+            gpio_backend.close()
+        if GPIO is not None:
             GPIO.cleanup()
-            app.logger.info("GPIO cleanup completed")
-        except Exception as e:
-            app.logger.error(f"Error during GPIO cleanup: {e}")
+        app.logger.info("GPIO cleanup completed")
+    except Exception as e:
+        app.logger.error(f"Error during GPIO cleanup: {e}")
+    # Last step of shutdown: drain queued log records to their handlers
+    if log_listener:
+        log_listener.stop()
 
 
 def signal_handler(signum, frame):
+    # Exiting runs the atexit hook, the single path into cleanup_gpio()
     app.logger.info(f"Received signal {signum}, shutting down...")
-    cleanup_gpio()
     sys.exit(0)
 
 
 atexit.register(cleanup_gpio)
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
 
 
 def main():
+    # Only when run directly; under gunicorn the worker's own handlers stay
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     setup_logging()
     app.logger.info("Starting Relay Control Application")
     if not setup_gpio():
         app.logger.error("Failed to initialize GPIO, exiting")
         sys.exit(1)
+    apply_cpu_affinity()
     try:
         app.run(
             host=config.HOST,
@@ -615,7 +1671,6 @@ def main():
         )
     except Exception as e:
         app.logger.error(f"Application error: {e}")
-        cleanup_gpio()
         sys.exit(1)
 
 
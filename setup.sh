@@ -105,7 +105,7 @@ Type=simple
 User=${USERNAME}
 Group=gpio
 WorkingDirectory=${APP_DIR}
-ExecStart=${APP_DIR}/venv/bin/gunicorn --workers 3 --bind unix:relay_control.sock -m 007 app:app
+ExecStart=${APP_DIR}/venv/bin/gunicorn --workers 1 --worker-class gthread --threads 8 --keep-alive 75 --bind unix:relay_control.sock -m 007 wsgi:application
 Restart=always
 RestartSec=10
 NoNewPrivileges=true
@@ -128,12 +128,24 @@ echo -e "${GREEN}7. Setting up Nginx reverse proxy...${NC}"
 usermod -a -G gpio www-data
 
 cat > $NGINX_AVAILABLE <<EOF
+# Reuse idle connections to gunicorn instead of reconnecting per request
+upstream relay_control {
+    server unix:${APP_DIR}/relay_control.sock;
+    keepalive 8;
+}
+
+# Only ask for a protocol upgrade when the client does; otherwise keep-alive
+map \$http_upgrade \$connection_upgrade {
+    default upgrade;
+    ''      '';
+}
+
 server {
     listen 80;
     server_name _;
 
     location / {
-        proxy_pass http://unix:${APP_DIR}/relay_control.sock;
+        proxy_pass http://relay_control;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
@@ -142,7 +154,7 @@ server {
         # WebSocket support (if needed in future)
         proxy_http_version 1.1;
         proxy_set_header Upgrade \$http_upgrade;
-        proxy_set_header Connection "upgrade";
+        proxy_set_header Connection \$connection_upgrade;
 
         # Timeouts
         proxy_connect_timeout 60s;
@@ -14,10 +14,8 @@ try:
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
 
-    # Setup pins
-    for pin in RELAY_PINS:
-        GPIO.setup(pin, GPIO.OUT)
-        GPIO.output(pin, GPIO.HIGH)  # Start with relays OFF (active-low)
+    # Setup all pins in one call, starting with relays OFF (active-low)
+    GPIO.setup(RELAY_PINS, GPIO.OUT, initial=GPIO.HIGH)
 
     # Test each relay
     for i, pin in enumerate(RELAY_PINS):
@@ -34,5 +32,9 @@ except KeyboardInterrupt:
 except Exception as e:
     print(f"Error: {e}")
 finally:
+    try:
+        GPIO.output(RELAY_PINS, GPIO.HIGH)  # Make sure every relay ends OFF
+    except Exception:
+        pass  # Pins were never set up
     GPIO.cleanup()
     print("GPIO cleaned up")
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for running the relay control app under gunicorn
+Use a single worker process: GPIO state and relay bookkeeping live in-process
+"""
+
+import sys
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import app, apply_cpu_affinity, setup_logging, setup_gpio
+
+setup_logging()
+app.logger.info("Starting Relay Control Application (WSGI)")
+if not setup_gpio():
+    app.logger.error("Failed to initialize GPIO, exiting")
+    sys.exit(1)
+apply_cpu_affinity()
+
+# gunicorn sits behind the nginx proxy on a unix socket, so take the client
+# address from the X-Forwarded-For entry nginx adds (IP allowlist, logs)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+
+application = app